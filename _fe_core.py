@@ -0,0 +1,129 @@
+import numpy as np
+from numba import njit, prange
+
+# Vị trí của từng tính năng trong vector đầu ra.
+# RẤT QUAN TRỌNG: Phải khớp với thứ tự FEATURE_COLUMNS trong features.py.
+LAST_OUTCOME_IS_TAI = 0
+LENGTH_OF_CURRENT_STREAK = 1
+TAI_RATIO_LAST_5 = 2
+XIU_RATIO_LAST_5 = 3
+TAI_RATIO_LAST_10 = 4
+XIU_RATIO_LAST_10 = 5
+TAI_RATIO_LAST_20 = 6
+XIU_RATIO_LAST_20 = 7
+NUM_SWITCHES_LAST_5 = 8
+NUM_SWITCHES_LAST_10 = 9
+IS_ALTERNATING_LAST_4 = 10
+IS_TWO_STREAK_ALTERNATING_LAST_6 = 11
+LONGEST_TAI_STREAK_LAST_20 = 12
+LONGEST_XIU_STREAK_LAST_20 = 13
+NUM_FEATURES = 14
+# Cửa sổ lịch sử dài nhất mà các tính năng (ngoài cầu hiện tại) sử dụng
+MAX_WINDOW = 20
+
+# Bit i của switch_mask = 1 nếu phiên i và i+1 khác nhau.
+# T-X-T-X: 3 cặp đầu đều khác nhau.
+_ALTERNATING_4_MASK = 0b111
+# TT-XX-TT: xét 5 cặp đầu, mẫu mong đợi là bằng, khác, bằng, khác, bằng.
+_TWO_STREAK_6_MASK = 0b11111
+_TWO_STREAK_6_PATTERN = 0b01010
+
+
+@njit(cache=True, fastmath=True)
+def fill_features(arr, out):
+    """
+    Tính toàn bộ tính năng trong một lần duyệt duy nhất.
+    arr: mảng int8 (1 = Tài, 0 = Xỉu) của cửa sổ lịch sử, từ MỚI NHẤT đến CŨ NHẤT.
+    out: mảng float32 độ dài NUM_FEATURES, được ghi đè tại chỗ.
+    Cầu hiện tại chỉ được đếm trong phạm vi arr.
+    """
+    n = arr.shape[0]
+    if n == 0:
+        return
+
+    first = arr[0]
+    out[LAST_OUTCOME_IS_TAI] = first
+
+    n5 = min(5, n)
+    n10 = min(10, n)
+    n20 = min(20, n)
+
+    tai = 0
+    switches = 0
+    switch_mask = 0
+    streak = 0
+    in_streak = True
+    cur_run = 0
+    max_tai = 0
+    max_xiu = 0
+
+    for i in range(n):
+        v = arr[i]
+        tai += v
+
+        if i > 0 and v != arr[i - 1]:
+            switches += 1
+            if i <= 5:
+                switch_mask |= 1 << (i - 1)
+            # Chuỗi trước vừa kết thúc: chỉ cập nhật max của Tài/Xỉu tại điểm chuyển
+            if i <= n20:
+                if v == 1:
+                    max_xiu = max(max_xiu, cur_run)
+                else:
+                    max_tai = max(max_tai, cur_run)
+            cur_run = 1
+        else:
+            cur_run += 1
+
+        if in_streak:
+            if v == first:
+                streak += 1
+            else:
+                in_streak = False
+
+        count = i + 1
+        if count == n5:
+            out[TAI_RATIO_LAST_5] = tai / n5
+            out[XIU_RATIO_LAST_5] = (n5 - tai) / n5
+            out[NUM_SWITCHES_LAST_5] = switches
+        if count == n10:
+            out[TAI_RATIO_LAST_10] = tai / n10
+            out[XIU_RATIO_LAST_10] = (n10 - tai) / n10
+            out[NUM_SWITCHES_LAST_10] = switches
+        if count == n20:
+            out[TAI_RATIO_LAST_20] = tai / n20
+            out[XIU_RATIO_LAST_20] = (n20 - tai) / n20
+            # Bao gồm cả chuỗi cuối cùng của cửa sổ
+            if v == 1:
+                max_tai = max(max_tai, cur_run)
+            else:
+                max_xiu = max(max_xiu, cur_run)
+            out[LONGEST_TAI_STREAK_LAST_20] = max_tai
+            out[LONGEST_XIU_STREAK_LAST_20] = max_xiu
+
+    out[LENGTH_OF_CURRENT_STREAK] = streak
+
+    if n >= 4 and (switch_mask & _ALTERNATING_4_MASK) == _ALTERNATING_4_MASK:
+        out[IS_ALTERNATING_LAST_4] = 1
+    if n >= 6 and (switch_mask & _TWO_STREAK_6_MASK) == _TWO_STREAK_6_PATTERN:
+        out[IS_TWO_STREAK_ALTERNATING_LAST_6] = 1
+
+
+@njit(cache=True, parallel=True)
+def fill_feature_matrix(arr, out):
+    """
+    Tính tính năng cho mọi hậu tố arr[s:] (s = 1 .. len(arr) - 1), song song theo từng dòng.
+    arr: mảng int8 (1 = Tài, 0 = Xỉu) của toàn bộ lịch sử, từ MỚI NHẤT đến CŨ NHẤT.
+    out: mảng float32 shape (len(arr) - 1, NUM_FEATURES) đã được đặt về 0, được ghi đè tại chỗ.
+    Khác với fill_features, cầu hiện tại được đếm trên toàn bộ hậu tố.
+    """
+    n = arr.shape[0]
+    # run_length[i] = độ dài chuỗi cùng kết quả bắt đầu tại i (đi về phía cũ hơn)
+    run_length = np.empty(n, dtype=np.int32)
+    run_length[n - 1] = 1
+    for i in range(n - 2, -1, -1):
+        run_length[i] = run_length[i + 1] + 1 if arr[i] == arr[i + 1] else 1
+
+    for s in prange(1, n):
+        fill_features(arr[s:s + MAX_WINDOW], out[s - 1])
+        out[s - 1, LENGTH_OF_CURRENT_STREAK] = run_length[s]
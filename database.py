@@ -1,6 +1,6 @@
 import os
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -24,6 +24,11 @@ class PhienTaiXiu(Base):
     tong_diem = Column(Integer) # Tổng điểm của phiên
     created_at = Column(DateTime, default=datetime.utcnow) # Thời gian record vào DB
 
+    __table_args__ = (
+        # Lịch sử luôn được đọc theo kai_jiang_time giảm dần
+        Index('ix_phien_kjt_desc', kai_jiang_time.desc()),
+    )
+
     def __repr__(self):
         return f"<PhienTaiXiu(expect_string={self.expect_string}, ket_qua_phien={self.ket_qua_phien}, tong_diem={self.tong_diem})>"
 
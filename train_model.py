@@ -1,97 +1,211 @@
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedShuffleSplit
+from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
 import joblib
 import os
+import pickle
 from datetime import datetime
 import sys
+from sqlalchemy import select
 
 # Đã thay đổi từ .database thành database để khắc phục ImportError
 from database import SessionLocal, PhienTaiXiu, Base, engine
 # Đã thay đổi từ .features thành features để khắc phục ImportError
-from features import create_training_data, FEATURE_COLUMNS
-
-def get_db_session():
-    """Dependency để lấy session database cho script huấn luyện."""
-    db = SessionLocal()
+from features import create_training_data, FEATURE_COLUMNS, TAI, XIU
+
+# Bản sao lịch sử trên đĩa: các lần huấn luyện sau chỉ truy vấn những phiên mới hơn bản sao.
+# Bảng chỉ được ghi thêm (không sửa phiên cũ); xóa file này để đọc lại toàn bộ từ database.
+HISTORY_CACHE_FILE = os.getenv("TRAIN_HISTORY_CACHE", "history_cache.parquet")
+
+# Thứ tự cột mong đợi, cố định một lần để so sánh trực tiếp với X.columns
+EXPECTED_FEATURE_COLUMNS = tuple(FEATURE_COLUMNS)
+
+# Mô hình được huấn luyện trên nhãn int8: 0 -> Tài, 1 -> Xỉu (cùng thứ tự với OUTCOME_LABELS trong main.py)
+LABEL_NAMES = [TAI, XIU]
+
+MODEL_FILENAME = 'model.pkl'
+# Đặt TRAIN_WARM_START=1 để huấn luyện tiếp model.pkl đã có (chỉ thêm WARM_START_EXTRA_ITER vòng boosting)
+# thay vì huấn luyện lại từ đầu. Mỗi lần chạy mô hình lớn thêm và tham số trong train_and_save_model
+# không được áp dụng lại, nên thỉnh thoảng vẫn cần huấn luyện lại từ đầu.
+TRAIN_WARM_START = os.getenv("TRAIN_WARM_START") == "1"
+WARM_START_EXTRA_ITER = 50
+
+# Đặt TRAIN_CREATE_TABLES=1 để tạo bảng (Base.metadata.create_all) trước khi huấn luyện
+TRAIN_CREATE_TABLES = os.getenv("TRAIN_CREATE_TABLES") == "1"
+
+# Đặt TRAIN_VERBOSE=1 để in thêm báo cáo phân loại và ma trận nhầm lẫn (mặc định chỉ in độ chính xác)
+TRAIN_VERBOSE = os.getenv("TRAIN_VERBOSE") == "1"
+
+def load_training_history(db) -> list:
+    """
+    Đọc toàn bộ kết quả lịch sử (bỏ các phiên chưa có kết quả), sắp xếp từ MỚI NHẤT -> CŨ NHẤT.
+    Dùng HISTORY_CACHE_FILE nếu có và chỉ truy vấn các dòng có id lớn hơn id lớn nhất đã lưu.
+    """
+    # Cột dạng Arrow (dtype_backend="pyarrow"): chuỗi kết quả nằm trong một mảng liền khối, không phải object Python từng dòng
+    cached = (
+        pd.read_parquet(HISTORY_CACHE_FILE, dtype_backend="pyarrow") if os.path.exists(HISTORY_CACHE_FILE) else None
+    )
+
+    # Chỉ đọc các cột cần thiết (bỏ các phiên chưa có kết quả ngay trong SQL), pandas đọc cả cột
+    # một lần qua driver thay vì tạo đối tượng ORM cho từng dòng
+    stmt = (
+        select(PhienTaiXiu.id, PhienTaiXiu.kai_jiang_time, PhienTaiXiu.ket_qua_phien)
+        .where(PhienTaiXiu.ket_qua_phien.is_not(None), PhienTaiXiu.ket_qua_phien != '')
+    )
+    if cached is not None and not cached.empty:
+        stmt = stmt.where(PhienTaiXiu.id > int(cached['id'].max()))
+    new_rows = pd.read_sql(stmt, db.connection(), dtype_backend="pyarrow")
+
+    if cached is None or cached.empty:
+        history = new_rows
+    elif new_rows.empty:
+        history = cached
+    else:
+        history = pd.concat([cached, new_rows], ignore_index=True)
+    if not new_rows.empty:
+        history.to_parquet(HISTORY_CACHE_FILE, index=False)
+        print(f"Đã lưu {len(history)} phiên lịch sử vào {HISTORY_CACHE_FILE} ({len(new_rows)} phiên mới).")
+
+    # Sử dụng kai_jiang_time để sắp xếp lịch sử từ MỚI NHẤT -> CŨ NHẤT (NULL đứng đầu như ORDER BY ... DESC của PostgreSQL)
+    history = history.sort_values('kai_jiang_time', ascending=False, na_position='first', kind='stable')
+    return history['ket_qua_phien'].tolist()
+
+def load_warm_start_model():
+    """Tải mô hình đã lưu để huấn luyện tiếp; trả về None nếu không có hoặc không dùng lại được."""
+    if not os.path.exists(MODEL_FILENAME):
+        return None
     try:
-        yield db
-    finally:
-        db.close()
+        model = joblib.load(MODEL_FILENAME)
+    except Exception as e:
+        print(f"Không tải được {MODEL_FILENAME} ({e}), huấn luyện lại từ đầu.")
+        return None
+    # Tính năng đã thay đổi (hoặc loại mô hình khác): không thể huấn luyện tiếp
+    if (not isinstance(model, HistGradientBoostingClassifier)
+            or getattr(model, 'n_features_in_', None) != len(EXPECTED_FEATURE_COLUMNS)
+            or model.classes_.tolist() != [0, 1]):
+        print(f"{MODEL_FILENAME} không khớp với tính năng hiện tại, huấn luyện lại từ đầu.")
+        return None
+    return model
 
 def train_and_save_model():
     print("--- Bắt đầu huấn luyện mô hình ---")
 
-    print("Kiểm tra và tạo bảng database nếu chưa tồn tại...")
-    Base.metadata.create_all(bind=engine)
-    print("Hoàn thành kiểm tra bảng.")
-
-    db_gen = get_db_session()
-    db = next(db_gen)
-
-    try:
-        # Lấy tất cả dữ liệu lịch sử từ database
-        # Sử dụng kai_jiang_time để sắp xếp lịch sử từ MỚI NHẤT -> CŨ NHẤT
-        all_historical_records_db = db.query(PhienTaiXiu).order_by(PhienTaiXiu.kai_jiang_time.desc()).all()
-        all_historical_results_strings = [rec.ket_qua_phien for rec in all_historical_records_db if rec.ket_qua_phien]
-
-        if not all_historical_results_strings:
-            print("Không có dữ liệu lịch sử trong database để huấn luyện mô hình.")
-            print("Vui lòng chạy ứng dụng FastAPI để thu thập dữ liệu trước khi huấn luyện.")
-            sys.exit(1)
-
-        print(f"Đã lấy {len(all_historical_results_strings)} bản ghi lịch sử từ database.")
-
-        X, y = create_training_data(all_historical_results_strings)
-
-        if X.empty or y.empty:
-            print("Không đủ dữ liệu sau khi tạo tính năng để huấn luyện mô hình.")
-            print("Đảm bảo bạn có ít nhất 2 phiên lịch sử có kết quả để tạo 1 mẫu huấn luyện.")
-            sys.exit(1)
-
-        if list(X.columns) != FEATURE_COLUMNS:
-            print(f"Lỗi nghiêm trọng: Thứ tự hoặc tên cột tính năng không khớp giữa features.py và dữ liệu tạo ra.")
-            print(f"Cột thực tế: {list(X.columns)}")
-            print(f"Cột mong đợi: {FEATURE_COLUMNS}")
-            print("Vui lòng kiểm tra lại FEATURE_COLUMNS trong features.py và hàm extract_features.")
+    # Huấn luyện cần dữ liệu sẵn có nên bảng phải đã tồn tại: chỉ kiểm tra/tạo bảng khi được yêu cầu
+    if TRAIN_CREATE_TABLES:
+        print("Kiểm tra và tạo bảng database nếu chưa tồn tại...")
+        Base.metadata.create_all(bind=engine)
+        print("Hoàn thành kiểm tra bảng.")
+
+    with SessionLocal() as db:
+        try:
+            # Lấy tất cả dữ liệu lịch sử (từ bản sao Parquet và database)
+            all_historical_results_strings = load_training_history(db)
+
+            if not all_historical_results_strings:
+                print("Không có dữ liệu lịch sử trong database để huấn luyện mô hình.")
+                print("Vui lòng chạy ứng dụng FastAPI để thu thập dữ liệu trước khi huấn luyện.")
+                sys.exit(1)
+
+            print(f"Đã lấy {len(all_historical_results_strings)} bản ghi lịch sử từ database.")
+
+            X, y = create_training_data(all_historical_results_strings)
+
+            if X.empty or y.empty:
+                print("Không đủ dữ liệu sau khi tạo tính năng để huấn luyện mô hình.")
+                print("Đảm bảo bạn có ít nhất 2 phiên lịch sử có kết quả để tạo 1 mẫu huấn luyện.")
+                sys.exit(1)
+
+            if tuple(X.columns) != EXPECTED_FEATURE_COLUMNS:
+                print(f"Lỗi nghiêm trọng: Thứ tự hoặc tên cột tính năng không khớp giữa features.py và dữ liệu tạo ra.")
+                print(f"Cột thực tế: {list(X.columns)}")
+                print(f"Cột mong đợi: {FEATURE_COLUMNS}")
+                print("Vui lòng kiểm tra lại FEATURE_COLUMNS trong features.py và hàm extract_features.")
+                sys.exit(1)
+
+            print(f"Đã tạo {len(X)} mẫu huấn luyện/kiểm tra từ lịch sử.")
+            print(f"Các tính năng được sử dụng: {list(EXPECTED_FEATURE_COLUMNS)}")
+            # X đã là float32 (features.py): chỉ lấy mảng NumPy, không để sklearn chuyển đổi DataFrame lần nữa.
+            # DataFrame trả về mảng theo thứ tự Fortran: chuyển một lần sang C-contiguous để fit không phải sao chép lại.
+            # Nhãn được mã hóa int8 một lần (0 = Tài, 1 = Xỉu) thay vì để mô hình so sánh chuỗi.
+            X = np.ascontiguousarray(X.to_numpy(dtype=np.float32))
+            y = (y == XIU).to_numpy(dtype=np.int8)
+
+            # Nhãn duy nhất và phân bố nhãn từ một lần bincount trên nhãn int8 (không sắp xếp)
+            label_counts = np.bincount(y, minlength=len(LABEL_NAMES))
+            print(f"Các nhãn (kết quả) duy nhất: {[LABEL_NAMES[i] for i in np.flatnonzero(label_counts)]}")
+            print("Phân bố nhãn:")
+            for label, share in zip(LABEL_NAMES, label_counts / label_counts.sum()):
+                print(f"{label}: {share:.6f}")
+
+            model = load_warm_start_model() if TRAIN_WARM_START else None
+            if model is not None:
+                # Huấn luyện tiếp: chia theo thời gian, 20% mẫu MỚI NHẤT để kiểm tra (X đi từ MỚI NHẤT đến CŨ NHẤT).
+                # Lịch sử chỉ ghi thêm nên ranh giới này chỉ tiến lên: tập kiểm tra không chứa mẫu mà các lần
+                # huấn luyện trước của mô hình đã học (cách chia ngẫu nhiên sẽ làm độ chính xác bị thổi phồng).
+                n_test = int(np.ceil(len(X) * 0.2))
+                X_test, X_train = X[:n_test], X[n_test:]
+                y_test, y_train = y[:n_test], y[n_test:]
+            else:
+                # Chỉ lấy chỉ số train/test rồi gom mảng một lần (cùng cách chia với train_test_split(..., stratify=y))
+                splitter = StratifiedShuffleSplit(n_splits=1, test_size=0.2, random_state=42)
+                (train_idx, test_idx), = splitter.split(X, y)
+                X_train, X_test = X[train_idx], X[test_idx]
+                y_train, y_test = y[train_idx], y[test_idx]
+
+            print(f"Kích thước tập huấn luyện: {len(X_train)} | Kích thước tập kiểm tra: {len(X_test)}")
+
+            if model is not None:
+                # Giữ các cây đã có và dựng thêm đúng WARM_START_EXTRA_ITER cây trên dữ liệu mới. Tắt early stopping:
+                # cửa sổ "không cải thiện" của mô hình cũ đã dùng hết nên nó sẽ dừng lại sau vài vòng.
+                model.set_params(
+                    warm_start=True, early_stopping=False, max_iter=model.n_iter_ + WARM_START_EXTRA_ITER
+                )
+                print(f"Huấn luyện tiếp mô hình từ {MODEL_FILENAME} ({model.n_iter_} vòng boosting sẵn có)...")
+            else:
+                # Gradient boosting trên histogram: tính năng được chia bin một lần, không phải sắp xếp lại ở mỗi lần tách nút
+                model = HistGradientBoostingClassifier(
+                    max_iter=300,
+                    learning_rate=0.05,
+                    max_bins=255,
+                    # Giới hạn kích thước cây: mô hình nhỏ hơn, predict ít cache miss hơn
+                    max_depth=12,
+                    # Mỗi lần tách nút chỉ xét ngẫu nhiên một nửa số tính năng: giảm thời gian dựng cây, cây đa dạng hơn
+                    max_features=0.5,
+                    early_stopping=True,
+                    class_weight='balanced',
+                    random_state=42
+                )
+                print("Bắt đầu huấn luyện mô hình Histogram Gradient Boosting...")
+            model.fit(X_train, y_train)
+            print("Huấn luyện mô hình hoàn tất.")
+
+            print("\n--- Đánh giá mô hình trên tập kiểm tra ---")
+            if TRAIN_VERBOSE:
+                y_pred = model.predict(X_test)
+
+                accuracy = accuracy_score(y_test, y_pred)
+                print(f"Độ chính xác (Accuracy): {accuracy:.4f}")
+                print("\nBáo cáo phân loại chi tiết:")
+                print(classification_report(y_test, y_pred, labels=[0, 1], target_names=LABEL_NAMES))
+                print("\nMa trận nhầm lẫn (Confusion Matrix):")
+                print(confusion_matrix(y_test, y_pred))
+            else:
+                accuracy = model.score(X_test, y_test)
+                print(f"Độ chính xác (Accuracy): {accuracy:.4f}")
+
+            model_filename = MODEL_FILENAME
+            # LZ4 nén gần bằng tốc độ ghi bộ nhớ: file nhỏ hơn nhiều mà gần như không tốn thêm thời gian ghi/đọc
+            joblib.dump(model, model_filename, compress=('lz4', 3), protocol=pickle.HIGHEST_PROTOCOL)
+            print(f"\nMô hình đã được lưu vào file: {model_filename}")
+
+            print("--- Hoàn thành huấn luyện mô hình ---")
+
+        except Exception as e:
+            print(f"Đã xảy ra lỗi trong quá trình huấn luyện mô hình: {e}")
             sys.exit(1)
 
-        print(f"Đã tạo {len(X)} mẫu huấn luyện/kiểm tra từ lịch sử.")
-        print(f"Các tính năng được sử dụng: {X.columns.tolist()}")
-        print(f"Các nhãn (kết quả) duy nhất: {y.unique().tolist()}")
-        print(f"Phân bố nhãn: \n{y.value_counts(normalize=True)}")
-
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
-
-        print(f"Kích thước tập huấn luyện: {len(X_train)} | Kích thước tập kiểm tra: {len(X_test)}")
-
-        model = RandomForestClassifier(n_estimators=200, random_state=42, class_weight='balanced', n_jobs=-1)
-        print("Bắt đầu huấn luyện mô hình Random Forest...")
-        model.fit(X_train, y_train)
-        print("Huấn luyện mô hình hoàn tất.")
-
-        print("\n--- Đánh giá mô hình trên tập kiểm tra ---")
-        y_pred = model.predict(X_test)
-        
-        accuracy = accuracy_score(y_test, y_pred)
-        print(f"Độ chính xác (Accuracy): {accuracy:.4f}")
-        print("\nBáo cáo phân loại chi tiết:")
-        print(classification_report(y_test, y_pred))
-        print("\nMa trận nhầm lẫn (Confusion Matrix):")
-        print(confusion_matrix(y_test, y_pred))
-
-        model_filename = 'model.pkl'
-        joblib.dump(model, model_filename)
-        print(f"\nMô hình đã được lưu vào file: {model_filename}")
-        print("--- Hoàn thành huấn luyện mô hình ---")
-
-    except Exception as e:
-        print(f"Đã xảy ra lỗi trong quá trình huấn luyện mô hình: {e}")
-        sys.exit(1)
-    finally:
-        db.close()
-
 if __name__ == "__main__":
     if not os.getenv("DATABASE_URL"):
         print("Lỗi: Biến môi trường DATABASE_URL chưa được thiết lập.")